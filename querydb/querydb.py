@@ -16,10 +16,14 @@ REC_TYPE / REC_VER / ANT_TYPE are encoded as '|' in the output file.
 The converters decode '|' back to spaces when writing RINEX headers.
 """
 
+import hashlib
+import io
 import os
 import re
+import signal
 import sys
-import time
+import threading
+from collections.abc import Iterator
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
@@ -28,8 +32,32 @@ import psycopg2
 
 
 FLOAT_RE = re.compile(r"[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+_WS_RE = re.compile(r"\s+")
+_IDENT_RE = re.compile(r"[A-Za-z0-9_\.\s,]+")
 SPACE_ENC = "|"  # encode spaces inside tokens for stations.list
 
+# Set by the SIGTERM/SIGINT handlers so loop() can exit mid-interval
+# instead of sleeping out the remainder of QUERYDB_INTERVAL_SECONDS.
+_stop = threading.Event()
+
+# Static stations.list header; only the generation metadata varies per refresh.
+_HEADER_TEMPLATE = (
+    "# stations.list (auto-generated)\n"
+    "# generated_at_utc=%(ts)s\n"
+    "# source=%(view)s\n"
+    "# mode=%(mode)s\n"
+    "%(where_line)s"
+    "#\n"
+    "# Token encoding: internal spaces in REC_TYPE/REC_VER/ANT_TYPE are written as '|'\n"
+    "# Decoding is handled by the converters when writing RINEX headers.\n"
+    "#\n"
+    "# <MOUNTPOINT> <RINEX_ID> <X> <Y> <Z> <REC_TYPE> <REC_VER> <ANT_TYPE> <ANT_H> <ANT_E> <ANT_N>\n"
+)
+
+# %-formatting of an all-string tuple is a single C-level pass in CPython,
+# cheaper per row than f-string/join bytecode.
+_ROW_FMT = "%s %s %s %s %s %s %s %s %s %s %s\n"
+
 
 def env(name: str, default: str | None = None) -> str | None:
     v = os.environ.get(name)
@@ -53,6 +81,14 @@ def now_utc_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
+def _is_floatish(s: str) -> bool:
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
 def parse_ecef_xyz(ecef_value) -> tuple[str, str, str] | None:
     """Accepts text like 'x y z' or 'x,y,z' or already-3 columns."""
     if ecef_value is None:
@@ -60,6 +96,14 @@ def parse_ecef_xyz(ecef_value) -> tuple[str, str, str] | None:
     if isinstance(ecef_value, (list, tuple)) and len(ecef_value) >= 3:
         return str(ecef_value[0]), str(ecef_value[1]), str(ecef_value[2])
     s = str(ecef_value)
+
+    # Fast path: almost all values are 'x y z' or 'x,y,z', which a plain
+    # split handles without the regex scan.
+    fields = s.replace(",", " ").split()
+    if len(fields) >= 3 and all(_is_floatish(p) for p in fields[:3]):
+        return fields[0], fields[1], fields[2]
+
+    # Fallback for decorated values like '(x, y, z)' or labelled text.
     nums = FLOAT_RE.findall(s)
     if len(nums) < 3:
         return None
@@ -73,7 +117,7 @@ def safe_ident(s: str, what: str) -> str:
     The user fully controls QUERYDB_* anyway; this is a guardrail.
     """
 
-    if not re.fullmatch(r"[A-Za-z0-9_\.\s,]+", s):
+    if not _IDENT_RE.fullmatch(s):
         raise ValueError(f"Invalid {what}: {s!r}")
     return s
 
@@ -92,8 +136,15 @@ def normalize_token(s: str | None, default: str = "") -> str:
     if s == "" or s.lower() == "null":
         return default
 
+    # Fast path: most tokens (e.g. 'TRIMBLE_NETR9') have no internal
+    # whitespace left after strip(), so the substitution (and its new
+    # string) can be skipped. search() agrees with sub() on what counts
+    # as whitespace by construction, so this cannot drift semantically.
+    if _WS_RE.search(s) is None:
+        return s
+
     # Stations.list is whitespace-separated; keep token single-field.
-    s = re.sub(r"\s+", SPACE_ENC, s)
+    s = _WS_RE.sub(SPACE_ENC, s)
 
     # NOTE: literal "|" characters in DB values are not escaped.
     # If present, converters will decode them as spaces.
@@ -101,16 +152,6 @@ def normalize_token(s: str | None, default: str = "") -> str:
     return s
 
 
-def format_float(v) -> str:
-    if v is None:
-        return ""
-    try:
-        # Preserve scientific notation if provided; psycopg2 may already return Decimal/float.
-        return str(v).strip()
-    except Exception:
-        return ""
-
-
 @dataclass
 class Config:
     host: str
@@ -129,6 +170,23 @@ class Config:
     ant_n_default: str
     once: bool
     mode: str  # auto | station_list_source | etat_antennes4
+    # Derived once in load_config; pure functions of the fields above.
+    is_new_view: bool = False
+    sql: str = ""
+    copy_sql: str = ""
+    dsn: str = ""
+
+
+def _dsn_value(v: str) -> str:
+    """Quote a libpq key=value connection-string value when needed.
+
+    Values containing spaces or quotes (passwords, mostly) must be
+    single-quoted with backslash escaping per the libpq rules.
+    """
+
+    if v != "" and " " not in v and "'" not in v and "\\" not in v:
+        return v
+    return "'" + v.replace("\\", "\\\\").replace("'", "\\'") + "'"
 
 
 def load_config() -> Config:
@@ -165,7 +223,7 @@ def load_config() -> Config:
     if interval_s < 60:
         interval_s = 60
 
-    return Config(
+    cfg = Config(
         host=host,
         port=port,
         dbname=dbname,
@@ -184,6 +242,27 @@ def load_config() -> Config:
         mode=mode,
     )
 
+    # The SQL is static for the lifetime of the process; compose it once
+    # instead of re-deriving it on every refresh.
+    cfg.is_new_view = is_station_list_source_view(cfg)
+    cfg.sql = build_sql(cfg)
+    if cfg.is_new_view:
+        cfg.copy_sql = build_copy_sql(cfg)
+
+    cfg.dsn = " ".join(
+        f"{k}={_dsn_value(str(v))}"
+        for k, v in (
+            ("host", cfg.host),
+            ("port", cfg.port),
+            ("dbname", cfg.dbname),
+            ("user", cfg.user),
+            ("password", cfg.password),
+            ("sslmode", cfg.sslmode),
+        )
+    )
+
+    return cfg
+
 
 def is_station_list_source_view(cfg: Config) -> bool:
     if cfg.mode == "station_list_source":
@@ -194,12 +273,71 @@ def is_station_list_source_view(cfg: Config) -> bool:
     return cfg.view.lower().endswith("station_list_source")
 
 
+def _sql_literal(s: str) -> str:
+    return "'" + s.replace("'", "''") + "'"
+
+
+def _station_line_expr(cfg: Config) -> str:
+    """SQL expression producing one finished stations.list line per row.
+
+    Normalization (trim, whitespace -> SPACE_ENC, defaults) is done
+    server-side, where the string ops run in C, so the client never has
+    to touch individual columns.
+    """
+
+    enc = _sql_literal(SPACE_ENC)
+
+    def ws_trim(expr: str) -> str:
+        # str.strip() equivalent: btrim() only trims spaces, so a leading
+        # tab or trailing newline would survive into the collapse step.
+        return f"regexp_replace({expr}, '^[[:space:]]+|[[:space:]]+$', '', 'g')"
+
+    def clean(col: str) -> str:
+        # Mirrors normalize_token: trim + whitespace -> SPACE_ENC, with
+        # ''/'null' (any case) mapped to NULL so coalesce supplies the
+        # default. '[[:space:]]' instead of '\s' so the pattern survives
+        # servers running with standard_conforming_strings=off.
+        expr = f"regexp_replace({ws_trim(col)}, '[[:space:]]+', {enc}, 'g')"
+        return f"case when {expr} = '' or lower({expr}) = 'null' then null else {expr} end"
+
+    def tok(col: str, default: str) -> str:
+        return f"coalesce({clean(col)}, {_sql_literal(default)})"
+
+    def num(col: str, default: str) -> str:
+        expr = ws_trim(f"{col}::text")
+        return (
+            f"coalesce(case when {expr} = '' or lower({expr}) = 'null' then null else {expr} end, "
+            f"{_sql_literal(default)})"
+        )
+
+    mp_expr = f"coalesce({clean('mp')}, '')"
+
+    fields = ", ".join(
+        (
+            mp_expr,
+            f"coalesce({clean('rinex_id')}, {mp_expr})",
+            f"coalesce({ws_trim('x::text')}, '')",
+            f"coalesce({ws_trim('y::text')}, '')",
+            f"coalesce({ws_trim('z::text')}, '')",
+            tok("rec_type", "UNKNOWN"),
+            tok("rec_ver", "UNKNOWN"),
+            tok("ant_type", "NONE" + SPACE_ENC + "NONE"),
+            num("ant_h", cfg.ant_h_default),
+            num("ant_e", cfg.ant_e_default),
+            num("ant_n", cfg.ant_n_default),
+        )
+    )
+    return f"concat_ws(' ', {fields})"
+
+
 def build_sql(cfg: Config) -> str:
     where = f" WHERE {cfg.where_sql} " if cfg.where_sql else " "
 
     if is_station_list_source_view(cfg):
+        # One already-formatted line per row; consumable through COPY or
+        # a plain cursor (row[0] is the finished line).
         return (
-            "SELECT mp, rinex_id, x, y, z, rec_type, rec_ver, ant_type, ant_h, ant_e, ant_n "
+            f"SELECT {_station_line_expr(cfg)} AS line "
             f"FROM {cfg.view}{where}ORDER BY {cfg.order_by};"
         )
 
@@ -210,130 +348,281 @@ def build_sql(cfg: Config) -> str:
     )
 
 
-def write_station_list(cfg: Config, rows: list[tuple]) -> int:
+def build_copy_sql(cfg: Config) -> str:
+    return "COPY (" + build_sql(cfg).rstrip().rstrip(";") + ") TO STDOUT"
+
+
+def _rows_digest(payload: bytes) -> bytes:
+    """Digest of the data rows only.
+
+    The header carries a generated_at_utc timestamp that changes every
+    refresh, so hashing the whole file would never match; comment lines
+    are skipped.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    for line in payload.split(b"\n"):
+        if line and not line.startswith(b"#"):
+            h.update(line)
+            h.update(b"\n")
+    return h.digest()
+
+
+# COPY TO text format escapes a data backslash as \\ and the control
+# characters below as C-style sequences; everything else passes through
+# raw. Undoing exactly this set restores the bytes a plain cursor would
+# have returned for the same values.
+_COPY_UNESCAPE = {
+    ord("\\"): ord("\\"),
+    ord("b"): 0x08,
+    ord("f"): 0x0C,
+    ord("n"): 0x0A,
+    ord("r"): 0x0D,
+    ord("t"): 0x09,
+    ord("v"): 0x0B,
+}
+
+
+def _copy_unescape(data: bytes) -> bytes:
+    if b"\\" not in data:
+        return data
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x5C and i + 1 < n:
+            m = _COPY_UNESCAPE.get(data[i + 1])
+            if m is not None:
+                out.append(m)
+                i += 2
+                continue
+        out.append(c)
+        i += 1
+    return bytes(out)
+
+
+def write_station_list(cfg: Config, conn) -> tuple[int, bool]:
     ts = now_utc_iso()
     out = cfg.output
-    out.parent.mkdir(parents=True, exist_ok=True)
-
     tmp = out.with_suffix(out.suffix + ".tmp")
 
-    sql = build_sql(cfg)
+    header = _HEADER_TEMPLATE % {
+        "ts": ts,
+        "view": cfg.view,
+        "mode": cfg.mode,
+        "where_line": f"# where={cfg.where_sql}\n" if cfg.where_sql else "",
+    }
+
+    # New mode: the view provides the final columns, so normalization and
+    # line assembly happen server-side and COPY streams ready-to-write
+    # lines straight into the payload — zero per-row Python work.
+    if cfg.is_new_view:
+        buf = io.BytesIO()
+        with conn.cursor() as cur:
+            cur.copy_expert(cfg.copy_sql, buf)
+            count = cur.rowcount
+        # Undo COPY's text-format escaping so tokens with backslashes or
+        # stray control bytes come out identical to the cursor path.
+        # connect() pins client_encoding to UTF8, so body and header
+        # share one encoding regardless of the database's own.
+        body = _copy_unescape(buf.getvalue())
+        return count, _replace_atomic(out, tmp, header.encode("utf-8") + body)
 
     count = 0
-    with tmp.open("w", encoding="utf-8", newline="\n") as f:
-        f.write("# stations.list (auto-generated)\n")
-        f.write(f"# generated_at_utc={ts}\n")
-        f.write(f"# source={cfg.view}\n")
-        f.write(f"# mode={cfg.mode}\n")
-        if cfg.where_sql:
-            f.write(f"# where={cfg.where_sql}\n")
-        f.write("#\n")
-        f.write("# Token encoding: internal spaces in REC_TYPE/REC_VER/ANT_TYPE are written as '|'\n")
-        f.write("# Decoding is handled by the converters when writing RINEX headers.\n")
-        f.write("#\n")
-        f.write("# <MOUNTPOINT> <RINEX_ID> <X> <Y> <Z> <REC_TYPE> <REC_VER> <ANT_TYPE> <ANT_H> <ANT_E> <ANT_N>\n")
-
-        for row in rows:
-            # New mode: view already provides final columns
-            if len(row) >= 11 and is_station_list_source_view(cfg):
-                (
-                    mp,
-                    rinex_id,
-                    x,
-                    y,
-                    z,
-                    rec_type,
-                    rec_ver,
-                    ant_type,
-                    ant_h,
-                    ant_e,
-                    ant_n,
-                ) = row[:11]
-
-                mp_t = normalize_token(mp)
-                rinex_id_t = normalize_token(rinex_id, mp_t)
-
-                x_t, y_t, z_t = format_float(x), format_float(y), format_float(z)
-
-                rec_type_t = normalize_token(rec_type, "UNKNOWN")
-                rec_ver_t = normalize_token(rec_ver, "UNKNOWN")
-
-                # ANT_TYPE is expected as "<antenna_id> <radome>" in DB view
-                ant_type_t = normalize_token(ant_type, "NONE|NONE")
-
-                ant_h_t = normalize_token(ant_h, cfg.ant_h_default)
-                ant_e_t = normalize_token(ant_e, cfg.ant_e_default)
-                ant_n_t = normalize_token(ant_n, cfg.ant_n_default)
-
-                f.write(
-                    f"{mp_t} {rinex_id_t} {x_t} {y_t} {z_t} {rec_type_t} {rec_ver_t} {ant_type_t} {ant_h_t} {ant_e_t} {ant_n_t}\n"
-                )
-                count += 1
-                continue
+    parts: list[str] = [header]
+
+    # Hoist per-row attribute/global lookups out of the loop: resolving
+    # cfg.* and module globals each iteration adds up over many rows.
+    anh, ane, ann = cfg.ant_h_default, cfg.ant_e_default, cfg.ant_n_default
+    norm = normalize_token
+    append = parts.append
+
+    # Stations share a handful of receiver/antenna models; normalize each
+    # distinct value once and reuse the resulting string across rows.
+    cache: dict[tuple, str] = {}
+
+    def cached_norm(raw, default: str) -> str:
+        key = (raw, default)
+        t = cache.get(key)
+        if t is None:
+            t = norm(raw, default)
+            cache[key] = t
+        return t
+
+    for row in fetch_rows(conn):
+        # Legacy mode: derive columns from etat_antennes4-like view
+        if len(row) < 6:
+            continue
+        mp, rinex_id, ecef, receiver, version, antenna = row[:6]
+
+        mp_t = norm(mp)
+        rinex_id_t = norm(rinex_id, mp_t)
+
+        xyz = parse_ecef_xyz(ecef)
+        if xyz is None:
+            x_t = y_t = z_t = ""
+        else:
+            x_t, y_t, z_t = xyz
+
+        rec_type_t = cached_norm(receiver, "UNKNOWN")
+        rec_ver_t = cached_norm(version, "UNKNOWN")
+
+        # Never write ADVNULLANTENNA into stations.list
+        ant_type_t = cached_norm(antenna, "NONE|NONE")
+
+        ant_h_t = anh
+        ant_e_t = ane
+        ant_n_t = ann
+
+        append(
+            _ROW_FMT % (mp_t, rinex_id_t, x_t, y_t, z_t, rec_type_t, rec_ver_t, ant_type_t, ant_h_t, ant_e_t, ant_n_t)
+        )
+        count += 1
 
-            # Legacy mode: derive columns from etat_antennes4-like view
-            if len(row) < 6:
-                continue
-            mp, rinex_id, ecef, receiver, version, antenna = row[:6]
+    return count, _replace_atomic(out, tmp, "".join(parts).encode("utf-8"))
 
-            mp_t = normalize_token(mp)
-            rinex_id_t = normalize_token(rinex_id, mp_t)
 
-            xyz = parse_ecef_xyz(ecef)
-            if xyz is None:
-                x_t = y_t = z_t = ""
-            else:
-                x_t, y_t, z_t = xyz
+def _replace_atomic(out: Path, tmp: Path, payload: bytes) -> bool:
+    """Atomically install *payload* as *out*.
 
-            rec_type_t = normalize_token(receiver, "UNKNOWN")
-            rec_ver_t = normalize_token(version, "UNKNOWN")
+    Returns False (leaving *out* untouched) when the data rows are
+    identical to what is already on disk, so downstream inotify watchers
+    and converters are not poked for a no-op refresh.
+    """
 
-            # Never write ADVNULLANTENNA into stations.list
-            ant_type_t = normalize_token(antenna, "NONE|NONE")
+    if out.exists():
+        try:
+            if _rows_digest(out.read_bytes()) == _rows_digest(payload):
+                return False
+        except OSError:
+            pass
+
+    # Single write + explicit fsync before the rename: without it a crash
+    # right after replace() could leave an empty/truncated stations.list
+    # on a freshly created inode.
+    fd = os.open(str(tmp), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, payload)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, out)
+
+    # Persist the rename itself by fsyncing the parent directory.
+    dfd = os.open(str(out.parent), os.O_RDONLY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
 
-            ant_h_t = cfg.ant_h_default
-            ant_e_t = cfg.ant_e_default
-            ant_n_t = cfg.ant_n_default
+    return True
 
-            f.write(
-                f"{mp_t} {rinex_id_t} {x_t} {y_t} {z_t} {rec_type_t} {rec_ver_t} {ant_type_t} {ant_h_t} {ant_e_t} {ant_n_t}\n"
-            )
-            count += 1
 
-    tmp.replace(out)
-    return count
+def connect(cfg: Config):
+    conn = psycopg2.connect(cfg.dsn)
+    # COPY returns bytes in client_encoding; pin it so the payload is
+    # UTF-8 like the header regardless of the database encoding.
+    conn.set_client_encoding("UTF8")
+    return conn
 
 
-def fetch_rows(cfg: Config) -> list[tuple]:
-    dsn = (
-        f"host={cfg.host} port={cfg.port} dbname={cfg.dbname} "
-        f"user={cfg.user} password={cfg.password} sslmode={cfg.sslmode}"
-    )
-    sql = build_sql(cfg)
+def prepare_plan(conn, cfg: Config) -> None:
+    """(Re)create the session-scoped prepared statement for the refresh query.
 
-    with psycopg2.connect(dsn) as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql)
-            return cur.fetchall()
+    Must be called once per connection (and again after every reconnect);
+    the plan lives for the lifetime of the session.
+    """
 
+    with conn.cursor() as cur:
+        cur.execute("PREPARE querydb_plan AS " + cfg.sql.rstrip().rstrip(";"))
+    # Commit so a later rollback between ticks cannot undo the PREPARE.
+    conn.commit()
 
-def loop(cfg: Config) -> None:
-    while True:
-        try:
-            rows = fetch_rows(cfg)
-            n = write_station_list(cfg, rows)
-            print(f"[{now_utc_iso()}] OK  rows={n} -> {cfg.output}")
-        except Exception as e:
-            print(f"[{now_utc_iso()}] ERR {type(e).__name__}: {e}", file=sys.stderr)
 
-        if cfg.once:
-            return
+def fetch_rows(conn) -> Iterator[tuple]:
+    # DECLARE ... CURSOR FOR cannot wrap EXECUTE, so the prepared plan runs
+    # on a regular cursor; rows stay in the libpq result until iterated.
+    # fetchmany(arraysize) converts them to Python tuples one batch at a
+    # time, so at most one batch of tuples is alive alongside the result.
+    with conn.cursor() as cur:
+        cur.arraysize = 2000
+        cur.execute("EXECUTE querydb_plan")
+        while True:
+            batch = cur.fetchmany()
+            if not batch:
+                return
+            yield from batch
 
-        time.sleep(cfg.interval_s)
+
+def loop(cfg: Config) -> None:
+    # Connection is kept open across refreshes; reconnecting every tick
+    # pays the TCP+TLS+auth handshake each time, which dominates at short
+    # intervals. On connection-level errors we drop it and reconnect lazily.
+    conn = None
+    prepared = False
+    try:
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = connect(cfg)
+                    prepared = False
+                # The COPY path composes its SQL inline; only the legacy
+                # cursor path goes through the prepared plan. The flag
+                # only flips after PREPARE succeeds, so a failed attempt
+                # (missing view, permissions, ...) is retried next tick
+                # instead of leaving the session unprepared for good.
+                if not cfg.is_new_view and not prepared:
+                    prepare_plan(conn, cfg)
+                    prepared = True
+                n, changed = write_station_list(cfg, conn)
+                conn.rollback()  # end the read-only transaction between ticks
+                if changed:
+                    print(f"[{now_utc_iso()}] OK  rows={n} -> {cfg.output}")
+                else:
+                    print(f"[{now_utc_iso()}] OK  rows={n} unchanged, skipped rewrite of {cfg.output}")
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                print(f"[{now_utc_iso()}] ERR {type(e).__name__}: {e} (will reconnect)", file=sys.stderr)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+            except Exception as e:
+                print(f"[{now_utc_iso()}] ERR {type(e).__name__}: {e}", file=sys.stderr)
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+                        conn = None
+
+            if cfg.once:
+                return
+
+            if _stop.wait(cfg.interval_s):
+                print(f"[{now_utc_iso()}] stop requested, exiting")
+                return
+    finally:
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
 
 
 def main() -> int:
     cfg = load_config()
+
+    # Output directory is created once here, not on every refresh.
+    cfg.output.parent.mkdir(parents=True, exist_ok=True)
+
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+
     print(
         f"[{now_utc_iso()}] querydb start host={cfg.host}:{cfg.port} db={cfg.dbname} view={cfg.view} mode={cfg.mode} interval_s={cfg.interval_s} output={cfg.output}"
     )